@@ -0,0 +1,356 @@
+# api/archive.py
+"""
+Tiered archival of cold crypto.trades partitions to Parquet.
+
+Export (run before TTL deletes a month, e.g. from cron):
+  python -m api.archive export             # every complete month not yet archived
+  python -m api.archive export 202407      # specific past months (--force to redo)
+  python -m api.archive list
+
+Each monthly partition (PARTITION BY toYYYYMM(ts)) is streamed out of
+ClickHouse as one zstd Parquet file sorted by (symbol, ts), so row groups
+carry tight per-symbol min/max stats. ARCHIVE_DIR/manifest.json records
+rows, min/max ts and per-symbol stats per file.
+
+Read path: the run of consecutive archived months from the window start
+(or from the earliest archived month, if the window reaches back past it)
+is served from the archive, and ClickHouse serves the window from the end
+of that run; a window starting in a month missing from the manifest goes
+to ClickHouse as a whole. The manifest prunes files, pyarrow
+prunes row groups via the (symbol, ts) filters, and the per-minute
+aggregation runs vectorised. pyarrow is an optional dependency
+(requirements-archive.txt), imported only when the archive is used.
+
+Months that started before now - ARCHIVE_HOT_DAYS may already be partly
+removed by TTL; export skips them unless --allow-partial is given, in which
+case they are recorded with "partial": true.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from src.db import ch_client
+from api.query_stats import tracked_query
+
+load_dotenv()
+
+CH_DATABASE = os.getenv("CH_DATABASE", "crypto")
+TABLE = f"{CH_DATABASE}.trades"
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "")                        # empty = archive disabled
+ARCHIVE_HOT_DAYS = int(os.getenv("ARCHIVE_HOT_DAYS", "90"))         # TTL horizon; keep in sync with V1
+ARCHIVE_ROW_GROUP_SIZE = int(os.getenv("ARCHIVE_ROW_GROUP_SIZE", "262144"))
+MANIFEST_NAME = "manifest.json"
+
+EXPORT_COLUMNS = "symbol, trade_id, price, qty, toDateTime64(ts, 3, 'UTC') AS ts, is_buyer_maker"
+
+_manifest_cache: Dict[str, Any] = {"path": None, "mtime": None, "data": None}
+
+
+# ---------- manifest ----------
+def manifest_path() -> str:
+    return os.path.join(ARCHIVE_DIR, MANIFEST_NAME)
+
+
+def load_manifest() -> Dict[str, Any]:
+    """Manifest as a dict, re-read only when the file changes."""
+    path = manifest_path()
+    if not ARCHIVE_DIR or not os.path.exists(path):
+        return {"table": TABLE, "partitions": {}}
+    mtime = os.path.getmtime(path)
+    if (_manifest_cache["path"], _manifest_cache["mtime"]) != (path, mtime):
+        with open(path, "r", encoding="utf-8") as f:
+            _manifest_cache["data"] = json.load(f)
+        _manifest_cache["path"], _manifest_cache["mtime"] = path, mtime
+    return _manifest_cache["data"]
+
+
+def save_manifest(manifest: Dict[str, Any]):
+    """Atomic write so readers never see a half-written manifest."""
+    tmp = manifest_path() + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, manifest_path())
+
+
+def _parse_ts(s: str) -> datetime:
+    return datetime.fromisoformat(s).replace(tzinfo=timezone.utc)
+
+
+def files_for(symbol: str, start: datetime, end: datetime) -> List[str]:
+    """Archived files that may hold `symbol` trades in [start, end), by manifest stats."""
+    out = []
+    for _, entry in sorted(load_manifest()["partitions"].items()):
+        stats = entry["symbols"].get(symbol)
+        if stats and _parse_ts(stats["min_ts"]) < end and _parse_ts(stats["max_ts"]) >= start:
+            out.append(os.path.join(ARCHIVE_DIR, entry["file"]))
+    return out
+
+
+# ---------- tiering ----------
+def month_bounds(partition: str):
+    """[start, end) in UTC of a toYYYYMM partition id such as "202407"."""
+    y, m = int(partition[:4]), int(partition[4:6])
+    start = datetime(y, m, 1, tzinfo=timezone.utc)
+    end = datetime(y + (m == 12), m % 12 + 1, 1, tzinfo=timezone.utc)
+    return start, end
+
+
+def archived_run(start: datetime) -> Optional[Tuple[datetime, datetime]]:
+    """
+    [run_start, run_end) of the consecutive archived months serving a window
+    that starts at `start`, or None. A window reaching back past the earliest
+    archived month starts the run there (older rows are gone from ClickHouse
+    too); otherwise `start`'s own month must be archived, so a gap in the
+    manifest is left to ClickHouse.
+    """
+    partitions = load_manifest()["partitions"]
+    if not partitions:
+        return None
+    run_start = month_bounds(min(partitions))[0]
+    if start >= run_start:
+        run_start = month_bounds(start.strftime("%Y%m"))[0]
+    run_end = run_start
+    while run_end.strftime("%Y%m") in partitions:
+        run_end = month_bounds(run_end.strftime("%Y%m"))[1]
+    return (run_start, run_end) if run_end > run_start else None
+
+
+def split(minutes: int, now: Optional[datetime] = None):
+    """
+    Split a `last N minutes` window into (hot_from, cold). cold is the
+    [start, end) part of the window covered by archived_run() (None if
+    there is none); hot_from is the epoch-seconds bound for
+    `ts >= toDateTime(%(hot_from)s)` in ClickHouse, i.e. the end of that
+    run, or 0 so ClickHouse serves the whole window.
+    """
+    if not ARCHIVE_DIR:
+        return 0, None
+    now = now or datetime.now(timezone.utc)
+    start = now - timedelta(minutes=minutes)
+    run = archived_run(start)
+    if run is None or run[0] >= now:
+        return 0, None
+    end = min(run[1], now)
+    return int(end.timestamp()), (max(start, run[0]), end)
+
+
+# ---------- vectorised reader ----------
+def read_cold(symbol: str, start: datetime, end: datetime, columns: List[str]):
+    """pyarrow Table of archived trades for one symbol in [start, end), sorted by ts."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    paths = files_for(symbol, start, end)
+    if not paths:
+        return None
+    filters = [("symbol", "=", symbol), ("ts", ">=", start), ("ts", "<", end)]
+    tables = [pq.read_table(p, columns=columns, filters=filters) for p in paths]
+    table = pa.concat_tables(tables) if len(tables) > 1 else tables[0]
+    return table.sort_by("ts") if table.num_rows else None
+
+
+def _per_minute(table, aggs):
+    import pyarrow.compute as pc
+
+    table = table.append_column("minute", pc.floor_temporal(table["ts"], unit="minute"))
+    return table.group_by("minute", use_threads=False).aggregate(aggs).sort_by("minute")
+
+
+def _minute_iso(ts: datetime) -> str:
+    # same naive-UTC form as the ClickHouse path; the web client appends 'Z'
+    return ts.replace(tzinfo=None).isoformat()
+
+
+def cold_ohlcv(symbol: str, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Per-minute OHLCV from the archive, same columns as /ohlcv."""
+    table = read_cold(symbol, start, end, ["ts", "price", "qty"])
+    if table is None:
+        return []
+    g = _per_minute(table, [("price", "first"), ("price", "max"), ("price", "min"),
+                            ("price", "last"), ("qty", "sum"), ("qty", "count")])
+    cols = {name: g[name].to_pylist() for name in g.column_names}
+    return [
+        {"minute": _minute_iso(m), "open": o, "high": h, "low": l, "close": c, "volume": v, "trades": n}
+        for m, o, h, l, c, v, n in zip(cols["minute"], cols["price_first"], cols["price_max"], cols["price_min"],
+                                       cols["price_last"], cols["qty_sum"], cols["qty_count"])
+    ]
+
+
+def cold_buy_sell(symbol: str, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Per-minute buy/sell volumes and VWAPs from the archive, same columns as /hist_buy_sell."""
+    import pyarrow.compute as pc
+
+    table = read_cold(symbol, start, end, ["ts", "price", "qty", "is_buyer_maker"])
+    if table is None:
+        return []
+    buy = pc.equal(table["is_buyer_maker"], 0)
+    pv = pc.multiply(table["price"], table["qty"])
+    table = (table
+             .append_column("buy_qty", pc.if_else(buy, table["qty"], 0.0))
+             .append_column("sell_qty", pc.if_else(buy, 0.0, table["qty"]))
+             .append_column("buy_pv", pc.if_else(buy, pv, 0.0))
+             .append_column("sell_pv", pc.if_else(buy, 0.0, pv)))
+    g = _per_minute(table, [("buy_qty", "sum"), ("sell_qty", "sum"), ("buy_pv", "sum"),
+                            ("sell_pv", "sum"), ("qty", "count")])
+    cols = {name: g[name].to_pylist() for name in g.column_names}
+    return [
+        {
+            "minute": _minute_iso(m),
+            "buy_volume": bv,
+            "sell_volume": sv,
+            "avg_buy_price": bpv / bv if bv else None,
+            "avg_sell_price": spv / sv if sv else None,
+            "trades": n,
+        }
+        for m, bv, sv, bpv, spv, n in zip(cols["minute"], cols["buy_qty_sum"], cols["sell_qty_sum"],
+                                          cols["buy_pv_sum"], cols["sell_pv_sum"], cols["qty_count"])
+    ]
+
+
+# ---------- export job ----------
+PARTITIONS_Q = """
+SELECT partition, sum(rows) AS rows
+FROM system.parts
+WHERE database = %(db)s AND table = 'trades' AND active
+GROUP BY partition
+ORDER BY partition
+"""
+
+PARTITION_STATS_Q = f"""
+SELECT
+  symbol,
+  count()  AS rows,
+  min(ts)  AS min_ts,
+  max(ts)  AS max_ts
+FROM {TABLE} FINAL
+WHERE toYYYYMM(ts) = %(partition)s
+GROUP BY symbol
+ORDER BY symbol
+"""
+
+PARTITION_EXPORT_Q = f"""
+SELECT {EXPORT_COLUMNS}
+FROM {TABLE} FINAL
+WHERE toYYYYMM(ts) = %(partition)s
+ORDER BY symbol, ts, trade_id
+"""
+
+
+def _iso(ts) -> str:
+    return ts.replace(tzinfo=None).isoformat() if hasattr(ts, "isoformat") else str(ts)
+
+
+def export_partition(client, partition: int) -> Dict[str, Any]:
+    """Stream one monthly partition to ARCHIVE_DIR as Parquet and return its manifest entry."""
+    import pyarrow.parquet as pq
+
+    stats = tracked_query(client, "archive", PARTITION_STATS_Q, {"partition": partition})
+    if not stats.result_rows:
+        raise RuntimeError(f"Partition {partition} is empty")
+    symbols = {s: {"rows": int(n), "min_ts": _iso(lo), "max_ts": _iso(hi)} for s, n, lo, hi in stats.result_rows}
+    rows = sum(v["rows"] for v in symbols.values())
+
+    filename = f"trades_{partition}.parquet"
+    path = os.path.join(ARCHIVE_DIR, filename)
+    tmp = path + ".tmp"
+    try:
+        stream = client.raw_stream(
+            PARTITION_EXPORT_Q,
+            parameters={"partition": partition},
+            settings={
+                "output_format_parquet_compression_method": "zstd",
+                "output_format_parquet_row_group_size": ARCHIVE_ROW_GROUP_SIZE,
+                "log_comment": json.dumps({"source": "archive", "partition": partition}),
+            },
+            fmt="Parquet",
+        )
+        with open(tmp, "wb") as f:
+            for chunk in iter(lambda: stream.read(1 << 20), b""):
+                f.write(chunk)
+        written = pq.read_metadata(tmp).num_rows
+        if written != rows:
+            raise RuntimeError(f"Partition {partition}: wrote {written} rows, expected {rows}")
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    return {
+        "file": filename,
+        "rows": rows,
+        "bytes": os.path.getsize(path),
+        "min_ts": min(v["min_ts"] for v in symbols.values()),
+        "max_ts": max(v["max_ts"] for v in symbols.values()),
+        "symbols": symbols,
+        "exported_at": datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
+    }
+
+
+def export(partitions: Optional[List[int]] = None, force: bool = False, allow_partial: bool = False):
+    """
+    Archive the given partitions, or every complete month missing from the
+    manifest. The current month is always refused, even with `force`.
+    Months starting before the TTL horizon are skipped unless
+    `allow_partial`, and then marked partial in the manifest.
+    """
+    if not ARCHIVE_DIR:
+        raise RuntimeError("Set ARCHIVE_DIR to enable archiving")
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    client = ch_client()
+    manifest = load_manifest()
+    manifest.setdefault("table", TABLE)
+    manifest.setdefault("partitions", {})
+
+    current = int(datetime.now(timezone.utc).strftime("%Y%m"))
+    if not partitions:
+        res = tracked_query(client, "archive", PARTITIONS_Q, {"db": CH_DATABASE})
+        partitions = [int(p) for p, _ in res.result_rows if int(p) < current]
+
+    ttl_horizon = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_HOT_DAYS)
+    for partition in partitions:
+        if partition >= current:
+            # still being written: split() would serve this month from a stale file
+            print(f"! Skipping {partition}: only complete months can be archived.")
+            continue
+        if str(partition) in manifest["partitions"] and not force:
+            print(f"= Skipping {partition} (already archived).")
+            continue
+        partial = month_bounds(str(partition))[0] < ttl_horizon
+        if partial and not allow_partial:
+            print(f"! Skipping {partition}: starts before the TTL horizon ({ARCHIVE_HOT_DAYS} days), "
+                  f"rows may already be deleted. Re-run with --allow-partial to archive what is left.")
+            continue
+        t0 = time.perf_counter()
+        print(f"→ Exporting {partition}{' (partial)' if partial else ''} …")
+        entry = export_partition(client, partition)
+        entry["partial"] = partial
+        manifest["partitions"][str(partition)] = entry
+        save_manifest(manifest)
+        print(f"✓ {partition}: {entry['rows']} rows, {entry['bytes']} bytes in {time.perf_counter() - t0:.1f}s")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Archive cold crypto.trades partitions to Parquet")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="export monthly partitions (YYYYMM)")
+    ex.add_argument("partitions", nargs="*", type=int)
+    ex.add_argument("--force", action="store_true", help="re-export partitions already in the manifest")
+    ex.add_argument("--allow-partial", action="store_true",
+                    help="also export months TTL may have partly deleted (marked partial)")
+    sub.add_parser("list", help="print the manifest")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "export":
+        export(args.partitions, args.force, args.allow_partial)
+    else:
+        json.dump(load_manifest(), sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == "__main__":
+    main()
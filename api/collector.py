@@ -5,6 +5,7 @@ from typing import Optional
 import websockets, certifi
 from dotenv import load_dotenv
 from src.db import ch_client
+from api.query_stats import tracked_insert
 
 load_dotenv()
 
@@ -76,8 +77,8 @@ class Collector:
             nonlocal buffer, client
             if not buffer:
                 return
-            client.insert(
-                TABLE, buffer,
+            tracked_insert(
+                client, "collector", TABLE, buffer,
                 column_names=["symbol","trade_id","price","qty","ts","is_buyer_maker"],
             )
             self._inserted += len(buffer)
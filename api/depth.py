@@ -0,0 +1,380 @@
+# api/depth.py
+"""
+Optional order-book depth pipeline (Binance <symbol>@depth@100ms).
+
+DepthCollector keeps one OrderBook per symbol, synced from the REST depth
+snapshot per Binance's diff-stream rules, and writes column-oriented batches:
+every applied diff to crypto.depth_deltas and the full book every
+DEPTH_SNAPSHOT_SEC to crypto.depth_snapshots. Raw frames are decoded in
+batches (one json.loads per batch) to keep per-message overhead down.
+
+book_at() rebuilds a book at any timestamp from those tables.
+"""
+import os, ssl, json, time, asyncio
+import urllib.request
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import websockets, certifi
+from dotenv import load_dotenv
+from src.db import ch_client
+from api.collector import SYMBOLS, ms_to_dt
+from api.orderbook import OrderBook, decode_levels
+from api.query_stats import tracked_insert, tracked_query
+
+load_dotenv()
+
+CH_DATABASE = os.getenv("CH_DATABASE", "crypto")
+DEPTH_SYMBOLS = [s.strip() for s in os.getenv("DEPTH_SYMBOLS", ",".join(SYMBOLS)).split(",") if s.strip()]
+DEPTH_BATCH_SIZE = int(os.getenv("DEPTH_BATCH_SIZE", "2000"))          # delta rows per insert
+DEPTH_FLUSH_EVERY_SEC = int(os.getenv("DEPTH_FLUSH_EVERY_SEC", "5"))
+DEPTH_SNAPSHOT_SEC = int(os.getenv("DEPTH_SNAPSHOT_SEC", "60"))
+DEPTH_DECODE_BATCH = int(os.getenv("DEPTH_DECODE_BATCH", "64"))        # raw frames per json.loads
+DEPTH_DECODE_MAX_MS = int(os.getenv("DEPTH_DECODE_MAX_MS", "50"))      # ... or this much buffering
+DEPTH_REST_LIMIT = int(os.getenv("DEPTH_REST_LIMIT", "1000"))
+DEPTH_MAX_PENDING = int(os.getenv("DEPTH_MAX_PENDING", "5000"))        # diffs buffered while syncing
+SNAPSHOTS_TABLE = f"{CH_DATABASE}.depth_snapshots"
+DELTAS_TABLE = f"{CH_DATABASE}.depth_deltas"
+
+SNAPSHOT_COLUMNS = ["symbol", "ts", "last_update_id", "bid_prices", "bid_qtys", "ask_prices", "ask_qtys"]
+DELTA_COLUMNS = ["symbol", "ts", "first_update_id", "final_update_id", "bid_prices", "bid_qtys", "ask_prices", "ask_qtys"]
+
+def depth_url(symbols): return f"wss://stream.binance.com:9443/stream?streams={'/'.join(f'{s}@depth@100ms' for s in symbols)}"
+
+def fetch_rest_snapshot(symbol: str, limit: int = DEPTH_REST_LIMIT) -> dict:
+    """GET /api/v3/depth (blocking; run in a thread)."""
+    url = f"https://api.binance.com/api/v3/depth?symbol={symbol.upper()}&limit={limit}"
+    ctx = ssl.create_default_context(cafile=certifi.where())
+    with urllib.request.urlopen(url, context=ctx, timeout=10) as resp:
+        return json.loads(resp.read())
+
+
+class _SymbolState:
+    __slots__ = ("book", "pending", "syncing", "snapshot_due", "last_snapshot_ms")
+
+    def __init__(self):
+        self.book: Optional[OrderBook] = None
+        self.pending: List[dict] = []
+        self.syncing = False
+        self.snapshot_due = False  # write the freshly synced book, stamped with the next diff's event time
+        self.last_snapshot_ms = 0
+
+
+class DepthCollector:
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        self._symbols = DEPTH_SYMBOLS
+        self._states: Dict[str, _SymbolState] = {}
+        self._sync_tasks: set = set()
+        self._deltas = {c: [] for c in DELTA_COLUMNS}
+        self._snapshots = {c: [] for c in SNAPSHOT_COLUMNS}
+        self._events = 0
+        self._deltas_inserted = 0
+        self._snapshots_inserted = 0
+        self._resyncs = 0
+        self._last_flush: Optional[datetime] = None
+        self._last_error: Optional[str] = None
+        self._state = "idle"  # idle|starting|running|stopping
+
+    def status(self) -> dict:
+        return {
+            "running": self._running,
+            "state": self._state,
+            "events": self._events,
+            "deltas_inserted": self._deltas_inserted,
+            "snapshots_inserted": self._snapshots_inserted,
+            "resyncs": self._resyncs,
+            "books": {s: (st.book.last_update_id if st.book else None) for s, st in self._states.items()},
+            "last_flush": self._last_flush.isoformat() if self._last_flush else None,
+            "last_error": self._last_error,
+            "symbols": list(self._symbols),
+            "batch_size": DEPTH_BATCH_SIZE,
+            "flush_every_sec": DEPTH_FLUSH_EVERY_SEC,
+            "snapshot_every_sec": DEPTH_SNAPSHOT_SEC,
+            "tables": [SNAPSHOTS_TABLE, DELTAS_TABLE],
+        }
+
+    def live_book(self, symbol: str) -> Optional[OrderBook]:
+        """In-memory book while the stream is up; None once stopped, so callers fall back to book_at."""
+        if not self._running:
+            return None
+        st = self._states.get(symbol.upper())
+        return st.book if st else None
+
+    async def start(self) -> bool:
+        if self._running or self._state in ("starting", "running"):
+            return False
+        self._state, self._last_error = "starting", None
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.sleep(0.3)
+        except asyncio.CancelledError:
+            pass
+        return True
+
+    async def stop(self) -> bool:
+        if not self._running and self._state != "running":
+            return False
+        self._state = "stopping"
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._state, self._running = "idle", False
+        return True
+
+    # ---------- book maintenance ----------
+    def _add_snapshot(self, book: OrderBook, ts_ms: int):
+        bp, bq, ap, aq = book.snapshot_columns()
+        for col, v in zip(SNAPSHOT_COLUMNS, (book.symbol, ms_to_dt(ts_ms), book.last_update_id, bp, bq, ap, aq)):
+            self._snapshots[col].append(v)
+
+    async def _sync(self, symbol: str):
+        st = self._states[symbol]
+        try:
+            while True:
+                snap = await asyncio.to_thread(fetch_rest_snapshot, symbol)
+                if not st.pending or int(st.pending[0]["U"]) <= int(snap["lastUpdateId"]) + 1:
+                    break
+                await asyncio.sleep(0.5)  # snapshot older than the buffered diffs; fetch a newer one
+            book = OrderBook(symbol)
+            book.load(int(snap["lastUpdateId"]), *decode_levels(snap["bids"]), *decode_levels(snap["asks"]))
+            st.book, st.snapshot_due, st.syncing = book, True, False
+            pending, st.pending = st.pending, []
+            for ev in pending:
+                self._handle(ev)
+        except Exception as e:
+            self._last_error = f"{symbol} sync: {type(e).__name__}: {e}"
+            await asyncio.sleep(1)  # back off before the next event retries
+            st.syncing = False
+
+    def _resync(self, symbol: str, st: _SymbolState):
+        if not st.syncing:
+            st.syncing = True
+            task = asyncio.create_task(self._sync(symbol))
+            self._sync_tasks.add(task)
+            task.add_done_callback(self._sync_tasks.discard)
+
+    def _handle(self, ev: dict):
+        symbol = ev["s"]
+        st = self._states.setdefault(symbol, _SymbolState())
+        book = st.book
+        if book is None:
+            st.pending.append(ev)
+            if len(st.pending) > DEPTH_MAX_PENDING:
+                del st.pending[0]
+            self._resync(symbol, st)
+            return
+        first_id, final_id = int(ev["U"]), int(ev["u"])
+        if final_id <= book.last_update_id:
+            return  # already covered by the snapshot
+        if first_id > book.last_update_id + 1:
+            # missed updates: drop the book and rebuild from a fresh REST snapshot
+            self._resyncs += 1
+            st.book, st.pending = None, [ev]
+            self._resync(symbol, st)
+            return
+        ts_ms = int(ev["E"])
+        if st.snapshot_due:
+            # event time, not wall clock, so book_at() orders it correctly against the deltas
+            st.snapshot_due, st.last_snapshot_ms = False, ts_ms
+            self._add_snapshot(book, ts_ms)
+        bp, bq = decode_levels(ev["b"])
+        ap, aq = decode_levels(ev["a"])
+        book.apply(final_id, bp, bq, ap, aq)
+        for col, v in zip(DELTA_COLUMNS, (symbol, ms_to_dt(ts_ms), first_id, final_id, bp, bq, ap, aq)):
+            self._deltas[col].append(v)
+        if ts_ms - st.last_snapshot_ms >= DEPTH_SNAPSHOT_SEC * 1000:
+            st.last_snapshot_ms = ts_ms
+            self._add_snapshot(book, ts_ms)
+
+    def _decode_batch(self, raw: List[str]):
+        for env in json.loads("[" + ",".join(raw) + "]"):
+            ev = env.get("data")
+            if ev and ev.get("e") == "depthUpdate":
+                self._events += 1
+                self._handle(ev)
+
+    # ---------- ingestion loop ----------
+    async def _run(self):
+        client = None
+        url = depth_url(self._symbols)
+        ssl_ctx = ssl.create_default_context()
+        ssl_ctx.load_verify_locations(certifi.where())
+
+        flush_lock = asyncio.Lock()
+
+        async def flush():
+            # swap the column buffers on the loop, then insert off it so a big
+            # batch doesn't stall the API requests sharing this event loop
+            async with flush_lock:
+                for table, attr, names, counter in (
+                    (SNAPSHOTS_TABLE, "_snapshots", SNAPSHOT_COLUMNS, "_snapshots_inserted"),
+                    (DELTAS_TABLE, "_deltas", DELTA_COLUMNS, "_deltas_inserted"),
+                ):
+                    cols = getattr(self, attr)
+                    n = len(cols["symbol"])
+                    if not n:
+                        continue
+                    setattr(self, attr, {c: [] for c in names})
+                    await asyncio.to_thread(tracked_insert, client, "depth", table, [cols[c] for c in names],
+                                            names, True)
+                    setattr(self, counter, getattr(self, counter) + n)
+                self._last_flush = datetime.now(timezone.utc)
+
+        async def periodic_flusher():
+            while True:
+                await asyncio.sleep(DEPTH_FLUSH_EVERY_SEC)
+                await flush()
+
+        try:
+            client = ch_client()
+            self._running, self._state = True, "running"
+            self._states = {s.upper(): _SymbolState() for s in self._symbols}
+            flusher = asyncio.create_task(periodic_flusher())
+            flush_task: Optional[asyncio.Task] = None
+            raw: List[str] = []
+            first_at = 0.0
+            try:
+                async with websockets.connect(url, ssl=ssl_ctx, ping_interval=20, ping_timeout=20,
+                                              max_size=None) as ws:
+                    while self._running:
+                        # wait for the next frame, but no longer than the decode deadline of the open batch
+                        timeout = None
+                        if raw:
+                            timeout = max(0.0, DEPTH_DECODE_MAX_MS / 1000 - (time.perf_counter() - first_at))
+                        try:
+                            msg = await asyncio.wait_for(ws.recv(), timeout)
+                        except asyncio.TimeoutError:
+                            msg = None
+                        except websockets.exceptions.ConnectionClosedOK:
+                            break
+                        if msg is not None:
+                            if not raw:
+                                first_at = time.perf_counter()
+                            raw.append(msg)
+                        if raw and (len(raw) >= DEPTH_DECODE_BATCH
+                                    or (time.perf_counter() - first_at) * 1000 >= DEPTH_DECODE_MAX_MS):
+                            batch, raw = raw, []
+                            self._decode_batch(batch)
+                        if flush_task is not None and flush_task.done():
+                            flush_task.result()  # surface insert errors
+                            flush_task = None
+                        if flush_task is None and len(self._deltas["symbol"]) >= DEPTH_BATCH_SIZE:
+                            flush_task = asyncio.create_task(flush())
+            finally:
+                if raw:
+                    self._decode_batch(raw)
+                for t in (flusher, *self._sync_tasks):
+                    t.cancel()
+                for t in (flusher, flush_task):
+                    if t is None:
+                        continue
+                    try:
+                        await t
+                    except asyncio.CancelledError:
+                        pass
+                await flush()
+        except Exception as e:
+            self._last_error = f"{type(e).__name__}: {e}"
+        finally:
+            self._running = False
+            if self._state != "stopping":
+                self._state = "idle"
+
+depth_collector = DepthCollector()
+
+
+# ---------- reconstruction ----------
+SNAPSHOT_AT_Q = f"""
+SELECT
+  toUnixTimestamp64Milli(ts) AS ts_ms,
+  last_update_id,
+  bid_prices,
+  bid_qtys,
+  ask_prices,
+  ask_qtys
+FROM {SNAPSHOTS_TABLE}
+WHERE symbol = %(symbol)s
+  AND ts <= fromUnixTimestamp64Milli(%(ts_ms)s, 'UTC')
+ORDER BY ts DESC, last_update_id DESC
+LIMIT 1
+"""
+
+DELTAS_BETWEEN_Q = f"""
+SELECT
+  first_update_id,
+  final_update_id,
+  bid_prices,
+  bid_qtys,
+  ask_prices,
+  ask_qtys
+FROM {DELTAS_TABLE}
+WHERE symbol = %(symbol)s
+  AND ts >= fromUnixTimestamp64Milli(%(from_ms)s, 'UTC')
+  AND ts <= fromUnixTimestamp64Milli(%(ts_ms)s, 'UTC')
+  AND final_update_id > %(from_id)s
+ORDER BY final_update_id
+"""
+
+NEXT_DELTA_Q = f"""
+SELECT first_update_id
+FROM {DELTAS_TABLE}
+WHERE symbol = %(symbol)s
+  AND ts > fromUnixTimestamp64Milli(%(ts_ms)s, 'UTC')
+  AND final_update_id > %(after_id)s
+ORDER BY ts, final_update_id
+LIMIT 1
+"""
+
+
+def book_at(symbol: str, ts_ms: int, levels: int = 20) -> Optional[dict]:
+    """
+    Order book for `symbol` as of `ts_ms`: nearest earlier snapshot plus the
+    deltas after it, checked for update-id continuity. If the chain breaks
+    before `ts_ms`, or the first delta after it doesn't follow on (the
+    collector lost the stream and resynced around `ts_ms`), the book can't
+    be trusted and is returned with "complete": False and no levels.
+    """
+    client = ch_client()
+    snap = tracked_query(client, "depth_book", SNAPSHOT_AT_Q, {"symbol": symbol, "ts_ms": ts_ms})
+    if not snap.result_rows:
+        return None
+    snap_ms, last_id, bp, bq, ap, aq = snap.result_rows[0]
+    book = OrderBook(symbol)
+    book.load(int(last_id), bp, bq, ap, aq)
+    deltas = tracked_query(client, "depth_book", DELTAS_BETWEEN_Q, {
+        "symbol": symbol, "from_ms": int(snap_ms), "ts_ms": ts_ms, "from_id": int(last_id),
+    })
+    out = {
+        "symbol": symbol,
+        "ts": ms_to_dt(ts_ms).isoformat(),
+        "snapshot_ts": ms_to_dt(int(snap_ms)).isoformat(),
+        "source": "clickhouse",
+    }
+    applied = 0
+    gap_next = None
+    for first_id, final_id, dbp, dbq, dap, daq in deltas.result_rows:
+        first_id, final_id = int(first_id), int(final_id)
+        if final_id <= book.last_update_id:
+            continue  # duplicate row not merged away yet
+        if first_id > book.last_update_id + 1:
+            gap_next = first_id
+            break
+        book.apply(final_id, dbp, dbq, dap, daq)
+        applied += 1
+    if gap_next is None:
+        nxt = tracked_query(client, "depth_book", NEXT_DELTA_Q, {
+            "symbol": symbol, "ts_ms": ts_ms, "after_id": book.last_update_id,
+        })
+        if nxt.result_rows and int(nxt.result_rows[0][0]) > book.last_update_id + 1:
+            gap_next = int(nxt.result_rows[0][0])
+    if gap_next is not None:
+        out.update({"complete": False, "last_update_id": book.last_update_id,
+                    "gap": {"after_update_id": book.last_update_id, "next_first_update_id": gap_next}})
+        return out
+    out.update(book.to_dict(levels))
+    out.update({"complete": True, "deltas_applied": applied})
+    return out
@@ -0,0 +1,93 @@
+# api/orderbook.py
+"""
+Compact local order book.
+
+Each side is two parallel array('d') buffers (prices ascending, qtys), updated
+in place with bisect: no per-level Python objects, and levels are copied out
+only when a snapshot or response is built.
+"""
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+
+def decode_levels(levels: Iterable[Sequence[str]]) -> Tuple[array, array]:
+    """Binance [["price","qty"], ...] -> (prices, qtys) via one flat float buffer."""
+    flat = array("d", map(float, chain.from_iterable(levels)))
+    return flat[0::2], flat[1::2]
+
+
+class BookSide:
+    __slots__ = ("prices", "qtys")
+
+    def __init__(self):
+        self.prices = array("d")
+        self.qtys = array("d")
+
+    def __len__(self):
+        return len(self.prices)
+
+    def load(self, prices: Sequence[float], qtys: Sequence[float]):
+        pairs = sorted((p, q) for p, q in zip(prices, qtys) if q != 0)
+        self.prices = array("d", (p for p, _ in pairs))
+        self.qtys = array("d", (q for _, q in pairs))
+
+    def apply(self, prices: Sequence[float], qtys: Sequence[float]):
+        """Absolute level updates; qty 0 removes the level."""
+        P, Q = self.prices, self.qtys
+        for p, q in zip(prices, qtys):
+            i = bisect_left(P, p)
+            if i < len(P) and P[i] == p:
+                if q == 0:
+                    del P[i]
+                    del Q[i]
+                else:
+                    Q[i] = q
+            elif q != 0:
+                P.insert(i, p)
+                Q.insert(i, q)
+
+    def best_first(self, descending: bool, n: int = 0) -> Tuple[array, array]:
+        """Copy of the top `n` levels (all if n <= 0), best price first."""
+        size = len(self.prices)
+        n = size if n <= 0 else min(n, size)
+        if descending:
+            return self.prices[size - n:][::-1], self.qtys[size - n:][::-1]
+        return self.prices[:n], self.qtys[:n]
+
+
+class OrderBook:
+    """Bids/asks for one symbol plus the last applied Binance update id."""
+
+    __slots__ = ("symbol", "last_update_id", "bids", "asks")
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.last_update_id = 0
+        self.bids = BookSide()
+        self.asks = BookSide()
+
+    def load(self, last_update_id: int, bid_prices, bid_qtys, ask_prices, ask_qtys):
+        self.last_update_id = last_update_id
+        self.bids.load(bid_prices, bid_qtys)
+        self.asks.load(ask_prices, ask_qtys)
+
+    def apply(self, final_update_id: int, bid_prices, bid_qtys, ask_prices, ask_qtys):
+        self.bids.apply(bid_prices, bid_qtys)
+        self.asks.apply(ask_prices, ask_qtys)
+        self.last_update_id = final_update_id
+
+    def snapshot_columns(self) -> Tuple[array, array, array, array]:
+        """Full book as (bid_prices, bid_qtys, ask_prices, ask_qtys), best first."""
+        return (*self.bids.best_first(True), *self.asks.best_first(False))
+
+    def to_dict(self, levels: int = 20) -> Dict[str, List[List[float]]]:
+        bp, bq = self.bids.best_first(True, levels)
+        ap, aq = self.asks.best_first(False, levels)
+        return {
+            "symbol": self.symbol,
+            "last_update_id": self.last_update_id,
+            "bids": [[p, q] for p, q in zip(bp, bq)],
+            "asks": [[p, q] for p, q in zip(ap, aq)],
+        }
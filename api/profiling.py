@@ -0,0 +1,160 @@
+# api/profiling.py
+"""
+Opt-in per-request sampling profiler.
+
+Set API_PROFILING=1 on the server, then add `?profile=1` or the header
+`X-Profile: 1` to any request. Instead of the normal body the API returns
+the sampled stacks in collapsed ("folded") format, one `frame;frame;... count`
+line per unique stack, ready for flamegraph.pl or speedscope.
+
+Only the event-loop thread and the threadpool worker that runs the handler
+(registered by ProfiledRoute) are sampled, and samples where the thread is
+parked in an idle wait are dropped, so concurrent requests and idle workers
+stay out of the graph.
+"""
+import os
+import sys
+import time
+import asyncio
+import functools
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional, Set
+
+from fastapi.routing import APIRoute
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+PROFILING_ENABLED = os.getenv("API_PROFILING", "0") == "1"
+PROFILE_INTERVAL_MS = float(os.getenv("API_PROFILE_INTERVAL_MS", "1"))
+
+# (file, function) of leaf frames that mean "this thread is waiting, not working"
+IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("runners.py", "run"),  # uvloop: the whole loop runs in C under asyncio.run
+}
+
+_active: ContextVar[Optional["SamplingProfiler"]] = ContextVar("active_profiler", default=None)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES
+
+
+class SamplingProfiler:
+    """Background thread that snapshots the target threads' stacks every `interval` seconds."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.samples = 0
+        self.idle_samples = 0
+        self.stacks: Counter = Counter()
+        self.threads: Set[int] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_thread(self, ident: int):
+        self.threads.add(ident)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            frames = sys._current_frames()
+            for tid in list(self.threads):
+                frame = frames.get(tid)
+                if frame is None:
+                    continue
+                if _is_idle(frame):
+                    self.idle_samples += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name="api-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {n}" for stack, n in self.stacks.most_common())
+
+
+def register_handler_thread(endpoint):
+    """Wrap a sync endpoint so the threadpool worker running it joins the active profile."""
+    if asyncio.iscoroutinefunction(endpoint):
+        return endpoint  # runs on the event-loop thread, which is always sampled
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        prof = _active.get()
+        if prof is None:
+            return endpoint(*args, **kwargs)
+        ident = threading.get_ident()
+        prof.add_thread(ident)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            prof.threads.discard(ident)  # the worker may go on to serve other requests
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """APIRoute whose sync endpoints report their worker thread to the profiler."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, register_handler_thread(endpoint), **kwargs)
+
+
+def profile_requested(request: Request) -> bool:
+    return PROFILING_ENABLED and (
+        request.query_params.get("profile") == "1" or request.headers.get("x-profile") == "1"
+    )
+
+
+async def profile_middleware(request: Request, call_next):
+    """Wrap the request in a SamplingProfiler when asked; otherwise pass through."""
+    if not profile_requested(request):
+        return await call_next(request)
+    prof = SamplingProfiler()
+    prof.add_thread(threading.get_ident())  # event loop
+    token = _active.set(prof)  # copied into the handler's task/thread context
+    started = time.perf_counter()
+    prof.start()
+    try:
+        response = await call_next(request)
+        # drain the body so the handler has fully finished before we stop sampling
+        async for _ in response.body_iterator:
+            pass
+    finally:
+        prof.stop()
+        _active.reset(token)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return PlainTextResponse(
+        prof.collapsed(),
+        headers={
+            "X-Profile-Format": "collapsed",
+            "X-Profile-Samples": str(prof.samples),
+            "X-Profile-Idle-Samples": str(prof.idle_samples),
+            "X-Profile-Interval-Ms": str(prof.interval * 1000),
+            "X-Profile-Elapsed-Ms": f"{elapsed_ms:.3f}",
+            "X-Profile-Status": str(response.status_code),
+        },
+    )
@@ -0,0 +1,185 @@
+# api/query_stats.py
+"""
+Per-query ClickHouse cost accounting.
+
+Every query from the API and the Collector goes through tracked_query /
+tracked_insert, which tag it with a structured query_id and log_comment
+(both visible in system.query_log), read ClickHouse's X-ClickHouse-Summary
+(read_rows, read_bytes, elapsed, result rows) off the result and feed it into
+the in-memory `query_stats` aggregator served by /debug/queries.
+"""
+import os
+import json
+import math
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence
+
+log = logging.getLogger("api.queries")
+
+QUERY_STATS_RECENT = int(os.getenv("QUERY_STATS_RECENT", "2000"))
+QUERY_STATS_MAX_SHAPES = int(os.getenv("QUERY_STATS_MAX_SHAPES", "256"))  # beyond this, fold into "other"
+DEBUG_ENABLED = os.getenv("API_DEBUG", "0") == "1"                      # exposes /debug/queries
+
+COST_KEYS = ("read_rows", "read_bytes", "result_rows", "written_rows", "elapsed_ms", "wall_ms")
+
+
+def _bucket(v: float) -> str:
+    """Power-of-two band for a numeric param, e.g. 60 -> "<=64"; bounds the number of shapes."""
+    if v <= 0:
+        return "<=0"
+    return f"<={1 << (math.ceil(v) - 1).bit_length()}"
+
+
+def param_shape(parameters: Optional[Dict[str, Any]]) -> str:
+    """
+    Group key for a parameter combination: numeric values (windows, limits)
+    drive cost so they are kept as power-of-two bands, strings (symbols) are
+    masked. e.g. {"symbol": "BTCUSDT", "minutes": 60} -> "minutes<=64,symbol=?"
+    """
+    if not parameters:
+        return "-"
+    return ",".join(
+        f"{k}{_bucket(v)}" if isinstance(v, (int, float)) and not isinstance(v, bool) else f"{k}=?"
+        for k, v in sorted(parameters.items())
+    )
+
+
+def _summary_int(summary: Dict[str, Any], key: str) -> Optional[int]:
+    try:
+        return int(summary[key])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class QueryStats:
+    """Thread-safe rolling window of recent queries plus per-endpoint / per-shape totals."""
+
+    def __init__(self, recent: int = QUERY_STATS_RECENT, max_shapes: int = QUERY_STATS_MAX_SHAPES):
+        self.max_shapes = max_shapes
+        self._shapes = 0
+        self._lock = threading.Lock()
+        self._recent: deque = deque(maxlen=recent)
+        self._totals: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self._started = time.time()
+
+    def record(self, rec: Dict[str, Any]):
+        with self._lock:
+            self._recent.append(rec)
+            by_shape = self._totals.setdefault(rec["endpoint"], {})
+            shape = rec["shape"]
+            if shape not in by_shape:
+                if self._shapes >= self.max_shapes:
+                    shape = "other"
+                if shape not in by_shape:
+                    self._shapes += 1
+            agg = by_shape.setdefault(shape, {"count": 0, "max_elapsed_ms": 0.0, **{k: 0 for k in COST_KEYS}})
+            agg["count"] += 1
+            for k in COST_KEYS:
+                agg[k] += rec.get(k) or 0
+            agg["max_elapsed_ms"] = max(agg["max_elapsed_ms"], rec.get("elapsed_ms") or 0)
+
+    def snapshot(self, top: int = 10, by: str = "read_bytes", window_sec: int = 300) -> Dict[str, Any]:
+        if by not in COST_KEYS:
+            raise ValueError(f"by must be one of {', '.join(COST_KEYS)}")
+        with self._lock:
+            recent = list(self._recent)
+            totals = {ep: {s: dict(a) for s, a in shapes.items()} for ep, shapes in self._totals.items()}
+        cutoff = time.time() - window_sec
+        window = [r for r in recent if r["at"] >= cutoff]
+
+        rolling: Dict[str, Dict[str, Any]] = {}
+        for r in window:
+            agg = rolling.setdefault(r["endpoint"], {"count": 0, **{k: 0 for k in COST_KEYS}, "_elapsed": []})
+            agg["count"] += 1
+            for k in COST_KEYS:
+                agg[k] += r.get(k) or 0
+            agg["_elapsed"].append(r.get("elapsed_ms") or 0)
+        for agg in rolling.values():
+            el = sorted(agg.pop("_elapsed"))
+            agg["elapsed_ms"], agg["wall_ms"] = round(agg["elapsed_ms"], 3), round(agg["wall_ms"], 3)
+            agg["qps"] = round(agg["count"] / window_sec, 3)
+            agg["p50_elapsed_ms"] = el[len(el) // 2]
+            agg["p95_elapsed_ms"] = el[min(len(el) - 1, int(len(el) * 0.95))]
+
+        shapes: List[Dict[str, Any]] = [
+            {"endpoint": ep, "shape": s, **a, "elapsed_ms": round(a["elapsed_ms"], 3), "wall_ms": round(a["wall_ms"], 3),
+             "avg_elapsed_ms": round(a["elapsed_ms"] / a["count"], 3)}
+            for ep, by_shape in totals.items() for s, a in by_shape.items()
+        ]
+        shapes.sort(key=lambda a: a[by], reverse=True)
+        return {
+            "since": self._started,
+            "window_sec": window_sec,
+            "by": by,
+            "rolling": rolling,
+            "top_queries": sorted(window, key=lambda r: r.get(by) or 0, reverse=True)[:top],
+            "top_shapes": shapes[:top],
+        }
+
+    def reset(self):
+        with self._lock:
+            self._recent.clear()
+            self._totals.clear()
+            self._shapes = 0
+            self._started = time.time()
+
+
+query_stats = QueryStats()
+
+
+def _tag(source: str, shape: str):
+    """Structured query_id + log_comment for one query."""
+    query_id = f"{source}:{uuid.uuid4().hex}"
+    comment = json.dumps({"source": source, "shape": shape}, separators=(",", ":"))
+    return query_id, shape, {"query_id": query_id, "log_comment": comment}
+
+
+def _record(source: str, query_id: str, shape: str, summary: Optional[Dict[str, Any]],
+            wall: float, result_rows: Optional[int] = None):
+    summary = summary or {}
+    elapsed_ns = _summary_int(summary, "elapsed_ns")
+    rec = {
+        "at": time.time(),
+        "endpoint": source,
+        "shape": shape,
+        "query_id": query_id,
+        "read_rows": _summary_int(summary, "read_rows"),
+        "read_bytes": _summary_int(summary, "read_bytes"),
+        "result_rows": _summary_int(summary, "result_rows") if result_rows is None else result_rows,
+        "written_rows": _summary_int(summary, "written_rows"),
+        "elapsed_ms": round(elapsed_ns / 1e6, 3) if elapsed_ns is not None else round(wall * 1000, 3),
+        "wall_ms": round(wall * 1000, 3),
+    }
+    query_stats.record(rec)
+    log.info("query %s", json.dumps(rec, separators=(",", ":")))
+
+
+def tracked_query(client, source: str, query: str, parameters: Optional[Dict[str, Any]] = None,
+                  shape_exclude: Sequence[str] = ()):
+    """
+    client.query() with a tagged query_id/log_comment; cost is recorded under
+    `source`. Params in `shape_exclude` (derived bounds, not user choices)
+    are left out of the shape.
+    """
+    shape_params = {k: v for k, v in (parameters or {}).items() if k not in shape_exclude}
+    query_id, shape, settings = _tag(source, param_shape(shape_params))
+    t0 = time.perf_counter()
+    res = client.query(query, parameters=parameters, settings=settings)
+    _record(source, query_id, shape, getattr(res, "summary", None), time.perf_counter() - t0,
+            result_rows=len(res.result_rows))
+    return res
+
+
+def tracked_insert(client, source: str, table: str, data, column_names=None, column_oriented: bool = False):
+    """client.insert() with a tagged query_id/log_comment; written rows are recorded under `source`."""
+    query_id, shape, settings = _tag(source, f"insert:{table}")
+    t0 = time.perf_counter()
+    res = client.insert(table, data, column_names=column_names, column_oriented=column_oriented, settings=settings)
+    rows = len(data[0]) if column_oriented and data else len(data)
+    summary = getattr(res, "summary", None) or {"written_rows": rows}
+    _record(source, query_id, shape, summary, time.perf_counter() - t0)
+    return res
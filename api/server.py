@@ -1,12 +1,17 @@
 # api/server.py
 import os
-from typing import List, Dict, Any
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
 
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 
 from src.db import ch_client
 from api.collector import collector
+from api.depth import depth_collector, book_at
+from api import archive
+from api.profiling import PROFILING_ENABLED, ProfiledRoute, profile_middleware
+from api.query_stats import DEBUG_ENABLED, query_stats, tracked_query
 
 APP_TITLE = "Crypto ClickHouse API"
 
@@ -18,6 +23,8 @@ ALLOWED_ORIGINS = [
 ]
 
 app = FastAPI(title=APP_TITLE)
+if PROFILING_ENABLED:
+    app.router.route_class = ProfiledRoute  # lets the profiler find the handler's worker thread
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +34,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ?profile=1 / X-Profile: 1 → folded stacks instead of the body. Only installed with
+# API_PROFILING=1 so normal runs (and load tests) don't pay for the extra middleware layer.
+if PROFILING_ENABLED:
+    app.middleware("http")(profile_middleware)
+
 
 def rows_to_dicts(result) -> List[Dict[str, Any]]:
     """clickhouse-connect result -> list of dicts."""
@@ -53,11 +65,57 @@ async def collector_status():
     return collector.status()
 
 
+# ---------- Depth (order book) collector ----------
+@app.post("/depth/start")
+async def start_depth():
+    started = await depth_collector.start()
+    return {"started": started, "status": depth_collector.status()}
+
+@app.post("/depth/stop")
+async def stop_depth():
+    stopped = await depth_collector.stop()
+    return {"stopped": stopped, "status": depth_collector.status()}
+
+@app.get("/depth/status")
+async def depth_status():
+    return depth_collector.status()
+
+
+# ---------- Query cost accounting ----------
+def require_debug():
+    """/debug/* is off unless API_DEBUG=1, like the profiler's API_PROFILING."""
+    if not DEBUG_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.get("/debug/queries")
+def debug_queries(
+    top: int = Query(10, ge=1, le=100),
+    by: str = Query("read_bytes", description="read_rows|read_bytes|result_rows|written_rows|elapsed_ms|wall_ms"),
+    window_sec: int = Query(300, ge=1, description="Rolling window for recent stats"),
+):
+    """
+    Most expensive recent queries and rolling per-endpoint stats over the
+    last `window_sec`, plus per endpoint/parameter-shape totals since start.
+    """
+    require_debug()
+    try:
+        return query_stats.snapshot(top=top, by=by, window_sec=window_sec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/debug/queries/reset")
+def debug_queries_reset():
+    require_debug()
+    query_stats.reset()
+    return {"reset": True}
+
+
 # ---------- Data endpoints ----------
 @app.get("/ohlcv")
 def ohlcv(symbol: str, minutes: int = 60):
     """
     1-min OHLCV for the last N minutes for a symbol.
+    Minutes in already-archived months are read from the Parquet archive.
     """
     q = """
     SELECT
@@ -71,16 +129,21 @@ def ohlcv(symbol: str, minutes: int = 60):
     FROM crypto.trades
     WHERE symbol = %(symbol)s
       AND ts >= now() - INTERVAL %(minutes)s MINUTE
+      AND ts >= toDateTime(%(hot_from)s, 'UTC')
     GROUP BY minute
     ORDER BY minute
     """
+    hot_from, cold = archive.split(minutes)
     client = ch_client()
-    res = client.query(q, parameters={"symbol": symbol, "minutes": minutes})
+    res = tracked_query(client, "ohlcv", q, {"symbol": symbol, "minutes": minutes, "hot_from": hot_from},
+                        shape_exclude=("hot_from",))
     rows = rows_to_dicts(res)
     # make ISO strings
     for r in rows:
         if hasattr(r["minute"], "isoformat"):
             r["minute"] = r["minute"].isoformat()
+    if cold:
+        rows = archive.cold_ohlcv(symbol, *cold) + rows
     return rows
 
 
@@ -101,7 +164,7 @@ def top_symbols(minutes: int = 10, limit: int = 10):
     LIMIT %(limit)s
     """
     client = ch_client()
-    res = client.query(q, parameters={"minutes": minutes, "limit": limit})
+    res = tracked_query(client, "top_symbols", q, {"minutes": minutes, "limit": limit})
     return rows_to_dicts(res)
 
 
@@ -124,7 +187,7 @@ def live_trades(symbol: str, window_sec: int = 60):
     LIMIT 500
     """
     client = ch_client()
-    res = client.query(q, parameters={"symbol": symbol, "sec": window_sec})
+    res = tracked_query(client, "live_trades", q, {"symbol": symbol, "sec": window_sec})
     rows = rows_to_dicts(res)
     for r in rows:
         if hasattr(r["ts"], "isoformat"):
@@ -165,7 +228,7 @@ def live_buy_sell(minutes: int = 10, top: int = 5):
     LIMIT %(top)s
     """
     client = ch_client()
-    res = client.query(q, parameters={"minutes": minutes, "top": top})
+    res = tracked_query(client, "live_buy_sell", q, {"minutes": minutes, "top": top})
     return rows_to_dicts(res)
 
 
@@ -176,6 +239,7 @@ def hist_buy_sell(
 ):
     """
     Per-minute series for buy/sell volume & avg price & trades/min for one symbol.
+    Minutes in already-archived months are read from the Parquet archive.
     """
     q = """
     SELECT
@@ -188,13 +252,51 @@ def hist_buy_sell(
     FROM crypto.trades
     WHERE symbol = %(symbol)s
       AND ts >= now() - INTERVAL %(minutes)s MINUTE
+      AND ts >= toDateTime(%(hot_from)s, 'UTC')
     GROUP BY minute
     ORDER BY minute
     """
+    hot_from, cold = archive.split(minutes)
     client = ch_client()
-    res = client.query(q, parameters={"symbol": symbol, "minutes": minutes})
+    res = tracked_query(client, "hist_buy_sell", q, {"symbol": symbol, "minutes": minutes, "hot_from": hot_from},
+                        shape_exclude=("hot_from",))
     rows = rows_to_dicts(res)
     for r in rows:
         if hasattr(r["minute"], "isoformat"):
             r["minute"] = r["minute"].isoformat()
-    return rows
\ No newline at end of file
+    if cold:
+        rows = archive.cold_buy_sell(symbol, *cold) + rows
+    return rows
+
+
+@app.get("/depth/book")
+def depth_book(
+    symbol: str,
+    at: Optional[str] = Query(None, description="ISO timestamp (UTC if no offset); omit for the latest book"),
+    levels: int = Query(20, ge=1, le=5000),
+):
+    """
+    Order book for a symbol at a point in time, rebuilt from the nearest
+    earlier snapshot plus deltas (409 if the stream had a gap there).
+    Without `at`, serves the live in-memory book when the depth collector
+    is running.
+    """
+    symbol = symbol.upper()
+    if at is None:
+        book = depth_collector.live_book(symbol)
+        if book is not None:
+            return {**book.to_dict(levels), "ts": datetime.now(timezone.utc).isoformat(), "source": "live"}
+        ts = datetime.now(timezone.utc)
+    else:
+        try:
+            ts = datetime.fromisoformat(at.replace("Z", "+00:00"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Bad timestamp: {at}")
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+    out = book_at(symbol, int(ts.timestamp() * 1000), levels)
+    if out is None:
+        raise HTTPException(status_code=404, detail=f"No depth snapshot for {symbol} at or before {ts.isoformat()}")
+    if not out["complete"]:
+        raise HTTPException(status_code=409, detail={"message": "Depth stream has a gap around this time", **out})
+    return out
@@ -0,0 +1,37 @@
+-- Order-book depth: periodic full snapshots + per-event deltas (Binance @depth@100ms).
+-- A book at time T = latest snapshot <= T, then deltas with
+-- final_update_id > snapshot.last_update_id and ts <= T, applied in update-id order.
+-- Levels are stored as parallel price/qty arrays; qty = 0 in a delta removes the level.
+
+CREATE TABLE IF NOT EXISTS crypto.depth_snapshots
+(
+    symbol          LowCardinality(String),
+    ts              DateTime64(3, 'UTC') CODEC(DoubleDelta, ZSTD),
+    last_update_id  UInt64 CODEC(Delta, ZSTD),
+    bid_prices      Array(Float64) CODEC(ZSTD),   -- best (highest) first
+    bid_qtys        Array(Float64) CODEC(ZSTD),
+    ask_prices      Array(Float64) CODEC(ZSTD),   -- best (lowest) first
+    ask_qtys        Array(Float64) CODEC(ZSTD),
+    ingested_at     DateTime DEFAULT now()
+)
+ENGINE = ReplacingMergeTree(ingested_at)
+PARTITION BY toYYYYMM(ts)
+ORDER BY (symbol, ts, last_update_id)
+TTL toDateTime(ts) + INTERVAL 90 DAY DELETE;
+
+CREATE TABLE IF NOT EXISTS crypto.depth_deltas
+(
+    symbol           LowCardinality(String),
+    ts               DateTime64(3, 'UTC') CODEC(DoubleDelta, ZSTD),   -- event time (E)
+    first_update_id  UInt64 CODEC(Delta, ZSTD),                       -- U
+    final_update_id  UInt64 CODEC(Delta, ZSTD),                       -- u
+    bid_prices       Array(Float64) CODEC(ZSTD),
+    bid_qtys         Array(Float64) CODEC(ZSTD),
+    ask_prices       Array(Float64) CODEC(ZSTD),
+    ask_qtys         Array(Float64) CODEC(ZSTD),
+    ingested_at      DateTime DEFAULT now()
+)
+ENGINE = ReplacingMergeTree(ingested_at)
+PARTITION BY toYYYYMMDD(ts)
+ORDER BY (symbol, ts, final_update_id)
+TTL toDateTime(ts) + INTERVAL 30 DAY DELETE;
@@ -0,0 +1,131 @@
+# src/ch_stub.py
+"""
+Local ClickHouse stand-in for load tests and offline demos.
+
+Enabled by CH_BACKEND=stub (see src/db.py). Answers any SELECT with synthetic
+rows shaped after the query's outer column list, after a configurable delay:
+
+  CH_STUB_ROWS        rows per result (default 60, capped by %(limit)s / %(top)s)
+  CH_STUB_LATENCY_MS  base latency per query (default 20)
+  CH_STUB_JITTER_MS   extra uniform random latency (default 0)
+"""
+import os
+import re
+import time
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+STUB_SYMBOLS = ["BTCUSDT", "ETHUSDT", "BNBUSDT", "SOLUSDT", "ADAUSDT"]
+
+_SELECT_RE = re.compile(r"\bSELECT\b(.*?)\bFROM\b", re.IGNORECASE | re.DOTALL)
+_ALIAS_RE = re.compile(r"\bAS\s+([A-Za-z_][A-Za-z0-9_]*)\s*$", re.IGNORECASE)
+
+
+def _split_top_level(expr_list: str) -> List[str]:
+    """Split a SELECT list on commas that are not inside parentheses."""
+    parts, depth, cur = [], 0, []
+    for ch in expr_list:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            parts.append("".join(cur))
+            cur = []
+        else:
+            cur.append(ch)
+    parts.append("".join(cur))
+    return [p.strip() for p in parts if p.strip()]
+
+
+def column_names_for(query: str) -> List[str]:
+    """Output column names of the outermost (last) SELECT in the query."""
+    matches = _SELECT_RE.findall(query)
+    if not matches:
+        return []
+    names = []
+    for expr in _split_top_level(matches[-1]):
+        m = _ALIAS_RE.search(expr)
+        names.append(m.group(1) if m else expr.split(".")[-1].strip())
+    return names
+
+
+class StubResult:
+    """Mimics the parts of clickhouse-connect's QueryResult the API uses."""
+
+    def __init__(self, column_names: Sequence[str], result_rows: List[tuple], elapsed: float):
+        self.column_names = tuple(column_names)
+        self.result_rows = result_rows
+        self.summary = {
+            "read_rows": str(len(result_rows) * 100),
+            "read_bytes": str(len(result_rows) * 100 * 48),
+            "result_rows": str(len(result_rows)),
+            "elapsed_ns": str(int(elapsed * 1e9)),
+        }
+
+    @property
+    def first_item(self):
+        return dict(zip(self.column_names, self.result_rows[0])) if self.result_rows else None
+
+
+class StubClient:
+    """Drop-in for clickhouse_connect's client: query/command/insert."""
+
+    def __init__(
+        self,
+        rows: Optional[int] = None,
+        latency_ms: Optional[float] = None,
+        jitter_ms: Optional[float] = None,
+        seed: Optional[int] = None,
+    ):
+        self.rows = rows if rows is not None else int(os.getenv("CH_STUB_ROWS", "60"))
+        self.latency_ms = latency_ms if latency_ms is not None else float(os.getenv("CH_STUB_LATENCY_MS", "20"))
+        self.jitter_ms = jitter_ms if jitter_ms is not None else float(os.getenv("CH_STUB_JITTER_MS", "0"))
+        self._rng = random.Random(seed)
+
+    def _sleep(self) -> float:
+        delay = (self.latency_ms + self._rng.uniform(0, self.jitter_ms)) / 1000
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def _value(self, name: str, i: int, n: int, now: datetime) -> Any:
+        if name in ("minute", "ts"):
+            step = timedelta(minutes=1) if name == "minute" else timedelta(seconds=1)
+            return now - step * (n - 1 - i)
+        if name == "symbol":
+            return STUB_SYMBOLS[i % len(STUB_SYMBOLS)]
+        if name.endswith("_prices"):
+            return [65000 + (k if name.startswith("ask") else -k) * 0.01 for k in range(1, 21)]
+        if name.endswith("_qtys"):
+            return [self._rng.uniform(0, 2) for _ in range(20)]
+        if name.endswith("_ms"):
+            return int(now.replace(tzinfo=timezone.utc).timestamp() * 1000) - (n - 1 - i) * 100
+        if name in ("trades", "count", "c") or name.endswith("_id"):
+            return self._rng.randint(1, 500)
+        if name == "is_buyer_maker":
+            return self._rng.randint(0, 1)
+        if "price" in name or name in ("open", "high", "low", "close"):
+            return 65000 + self._rng.uniform(-50, 50)
+        return self._rng.uniform(0, 10)
+
+    def query(self, query: str, parameters: Optional[Dict[str, Any]] = None, **kwargs) -> StubResult:
+        elapsed = self._sleep()
+        params = parameters or {}
+        n = self.rows
+        for cap in ("limit", "top"):
+            if isinstance(params.get(cap), int):
+                n = min(n, params[cap])
+        cols = column_names_for(query)
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        rows = [tuple(self._value(c, i, n, now) for c in cols) for i in range(n)]
+        return StubResult(cols, rows, elapsed)
+
+    def command(self, cmd: str, parameters: Optional[Dict[str, Any]] = None, **kwargs):
+        self._sleep()
+        return None
+
+    def insert(self, table: str, data, column_names=None, **kwargs):
+        self._sleep()
+        return None
@@ -11,7 +11,14 @@ def ch_client():
     Create and return a ClickHouse client using environment variables.
     Secure=True → forces TLS (HTTPS).
     verify=True + certifi → ensures SSL certificates are valid.
+    CH_BACKEND=stub → local synthetic stand-in (see ch_stub.py), no network.
     """
+    if os.getenv("CH_BACKEND", "clickhouse") == "stub":
+        if __package__:
+            from .ch_stub import StubClient
+        else:
+            from ch_stub import StubClient
+        return StubClient()
     return get_client(
         host=os.getenv("CH_HOST"),
         port=int(os.getenv("CH_PORT", "8443")),
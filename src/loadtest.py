@@ -0,0 +1,287 @@
+# src/loadtest.py
+"""
+Load generator for api/server.py.
+
+Replays the dashboard's request pattern (web/main.js) with N concurrent
+virtual users and reports throughput and p50/p95/p99 latency per endpoint as
+JSON, so runs can be diffed for regressions.
+
+By default the API is started as a uvicorn subprocess on a free port with
+the stubbed ClickHouse backend (src/ch_stub.py), so no cluster is needed and
+the client does not compete with the server for the GIL:
+
+  python -m src.loadtest --users 20 --duration 30 --rows 500 --latency-ms 15 --out bench.json
+
+Point it at a running server instead with --url (the backend is then whatever
+that server uses). --profile-dir saves one folded-stack profile per endpoint
+(see api/profiling.py).
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+DEFAULT_SYMBOLS = ["BTCUSDT", "ETHUSDT", "BNBUSDT", "SOLUSDT", "ADAUSDT"]
+
+# (weight, endpoint, params factory). Weights follow web/main.js cadence over
+# ~10s on the Live tab: ingest counter polls /live_trades?window_sec=5 every
+# 2s, counters poll /top_symbols every 10s, and a loadLive() refresh issues
+# /top_symbols + /ohlcv + /live_trades. The Historical tab is one /ohlcv call
+# over a long window per apply.
+Mix = List[Tuple[float, str, Callable[[random.Random], Dict]]]
+
+MIXES: Dict[str, Mix] = {
+    "live": [
+        (5, "/live_trades", lambda r: {"window_sec": 5, "symbol": "BTCUSDT"}),
+        (1, "/top_symbols", lambda r: {"minutes": r.choice([10, 30, 60]), "limit": 5}),
+        (1, "/top_symbols", lambda r: {"minutes": r.choice([10, 30, 60]), "limit": r.choice([5, 10])}),
+        (1, "/ohlcv", lambda r: {"symbol": r.choice(DEFAULT_SYMBOLS), "minutes": r.choice([10, 30, 60])}),
+        (1, "/live_trades", lambda r: {"window_sec": r.choice([30, 60, 120]), "symbol": r.choice(DEFAULT_SYMBOLS)}),
+    ],
+    "historical": [
+        (1, "/ohlcv", lambda r: {"symbol": r.choice(DEFAULT_SYMBOLS), "minutes": r.choice([60, 360, 1440])}),
+    ],
+}
+MIXES["dashboard"] = MIXES["live"] + [(2, *entry[1:]) for entry in MIXES["historical"]] + [
+    (0.2, "/collector/status", lambda r: {}),
+]
+
+
+def percentile(sorted_vals: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_vals:
+        return None
+    k = max(0, math.ceil(pct / 100 * len(sorted_vals)) - 1)
+    return sorted_vals[k]
+
+
+def summarize(latencies: List[float], errors: int, duration: float) -> Dict:
+    lat = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "requests": len(lat) + errors,
+        "errors": errors,
+        "rps": round((len(lat) + errors) / duration, 2) if duration else 0.0,
+        "p50_ms": ms(percentile(lat, 50)),
+        "p95_ms": ms(percentile(lat, 95)),
+        "p99_ms": ms(percentile(lat, 99)),
+        "max_ms": ms(lat[-1] if lat else None),
+    }
+
+
+def fetch(url: str, timeout: float, headers: Optional[Dict] = None) -> Tuple[int, bytes]:
+    req = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+class LoadRun:
+    """Closed-loop load: each virtual user issues its next request as soon as the last one returns."""
+
+    def __init__(self, base_url: str, mix: Mix, users: int, duration: float,
+                 think_ms: float = 0, timeout: float = 10, seed: Optional[int] = None):
+        self.base_url = base_url.rstrip("/")
+        self.mix = mix
+        self.users = users
+        self.duration = duration
+        self.think = think_ms / 1000
+        self.timeout = timeout
+        self.seed = seed
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def _record(self, endpoint: str, elapsed: Optional[float]):
+        with self._lock:
+            self.latencies.setdefault(endpoint, [])
+            self.errors.setdefault(endpoint, 0)
+            if elapsed is None:
+                self.errors[endpoint] += 1
+            else:
+                self.latencies[endpoint].append(elapsed)
+
+    def _user(self, idx: int, deadline: float):
+        rng = random.Random(None if self.seed is None else self.seed + idx)
+        weights = [w for w, _, _ in self.mix]
+        while time.perf_counter() < deadline:
+            _, endpoint, params = rng.choices(self.mix, weights=weights)[0]
+            qs = urlencode(params(rng))
+            url = f"{self.base_url}{endpoint}" + (f"?{qs}" if qs else "")
+            t0 = time.perf_counter()
+            try:
+                status, _ = fetch(url, self.timeout)
+                ok = 200 <= status < 300
+            except Exception:
+                ok = False
+            self._record(endpoint, time.perf_counter() - t0 if ok else None)
+            if self.think:
+                time.sleep(self.think)
+
+    def run(self) -> Dict:
+        started = time.perf_counter()
+        deadline = started + self.duration
+        threads = [threading.Thread(target=self._user, args=(i, deadline), daemon=True) for i in range(self.users)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        all_lat = [v for vals in self.latencies.values() for v in vals]
+        return {
+            "duration_s": round(elapsed, 3),
+            "total": summarize(all_lat, sum(self.errors.values()), elapsed),
+            "endpoints": {
+                ep: summarize(self.latencies[ep], self.errors[ep], elapsed)
+                for ep in sorted(self.latencies)
+            },
+        }
+
+
+def profile_endpoints(base_url: str, mix: Mix, out_dir: str, timeout: float) -> Dict[str, str]:
+    """Issue one profiled request per distinct endpoint and write <endpoint>.folded files."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(0)
+    written = {}
+    for _, endpoint, params in mix:
+        if endpoint in written:
+            continue
+        qs = urlencode(params(rng))
+        status, body = fetch(f"{base_url}{endpoint}" + (f"?{qs}" if qs else ""), timeout, {"X-Profile": "1"})
+        path = os.path.join(out_dir, endpoint.strip("/").replace("/", "_") + ".folded")
+        with open(path, "wb") as f:
+            f.write(body)
+        written[endpoint] = path
+    return written
+
+
+# ---------- local server with stubbed ClickHouse ----------
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub_server(rows: int, latency_ms: float, jitter_ms: float, profiling: bool,
+                      startup_timeout: float = 30):
+    """
+    Run `uvicorn api.server:app` in a subprocess backed by the ClickHouse stub,
+    so the load client's threads don't share a GIL with the server under test.
+    """
+    env = {
+        **os.environ,
+        "CH_BACKEND": "stub",
+        "CH_STUB_ROWS": str(rows),
+        "CH_STUB_LATENCY_MS": str(latency_ms),
+        "CH_STUB_JITTER_MS": str(jitter_ms),
+        "API_PROFILING": "1" if profiling else "0",
+    }
+    port = free_port()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.server:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=root, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.perf_counter() + startup_timeout
+    while True:
+        if proc.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {proc.returncode}")
+        try:
+            fetch(f"{base_url}/collector/status", 1)
+            return proc, base_url
+        except OSError:
+            if time.perf_counter() > deadline:
+                proc.kill()
+                raise RuntimeError("uvicorn did not start in time")
+            time.sleep(0.1)
+
+
+def stop_stub_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def print_table(report: Dict):
+    rows = [("endpoint", "req", "err", "rps", "p50", "p95", "p99", "max")]
+    for ep, s in [*report["endpoints"].items(), ("TOTAL", report["total"])]:
+        rows.append((ep, s["requests"], s["errors"], s["rps"], s["p50_ms"], s["p95_ms"], s["p99_ms"], s["max_ms"]))
+    widths = [max(len(str(r[i])) for r in rows) for i in range(len(rows[0]))]
+    for r in rows:
+        print("  ".join(str(v).rjust(w) for v, w in zip(r, widths)), file=sys.stderr)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Dashboard traffic load test for the Crypto ClickHouse API")
+    ap.add_argument("--url", help="target a running API instead of a local stubbed one")
+    ap.add_argument("--mix", choices=sorted(MIXES), default="dashboard")
+    ap.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    ap.add_argument("--duration", type=float, default=20, help="seconds")
+    ap.add_argument("--think-ms", type=float, default=0, help="pause between a user's requests")
+    ap.add_argument("--timeout", type=float, default=10)
+    ap.add_argument("--seed", type=int)
+    ap.add_argument("--rows", type=int, default=60, help="stub: rows per result")
+    ap.add_argument("--latency-ms", type=float, default=20, help="stub: per-query latency")
+    ap.add_argument("--jitter-ms", type=float, default=0, help="stub: extra random latency")
+    ap.add_argument("--profile-dir", help="also save one folded-stack profile per endpoint here")
+    ap.add_argument("--out", help="write JSON report here (default: stdout)")
+    args = ap.parse_args(argv)
+
+    server = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        server, base_url = start_stub_server(args.rows, args.latency_ms, args.jitter_ms, bool(args.profile_dir))
+
+    mix = MIXES[args.mix]
+    started_at = datetime.now(timezone.utc).isoformat()
+    try:
+        report = LoadRun(base_url, mix, args.users, args.duration, args.think_ms, args.timeout, args.seed).run()
+        profiles = profile_endpoints(base_url, mix, args.profile_dir, args.timeout) if args.profile_dir else {}
+    finally:
+        if server:
+            stop_stub_server(server)
+
+    report = {
+        "started_at": started_at,
+        "config": {
+            "target": args.url or "local subprocess (stub)",
+            "mix": args.mix,
+            "users": args.users,
+            "duration_s": args.duration,
+            "think_ms": args.think_ms,
+            **({} if args.url else {"stub_rows": args.rows, "stub_latency_ms": args.latency_ms,
+                                    "stub_jitter_ms": args.jitter_ms}),
+        },
+        **report,
+        **({"profiles": profiles} if profiles else {}),
+    }
+    print_table(report)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import api.archive as archive
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+UTC = timezone.utc
+NOW = datetime(2026, 10, 15, 12, 0, tzinfo=UTC)
+DAY = 1440
+
+# ClickHouse column aliases of /ohlcv and /hist_buy_sell in api/server.py
+OHLCV_COLUMNS = ["minute", "open", "high", "low", "close", "volume", "trades"]
+BUY_SELL_COLUMNS = ["minute", "buy_volume", "sell_volume", "avg_buy_price", "avg_sell_price", "trades"]
+
+
+def at(*args):
+    return datetime(*args, tzinfo=UTC)
+
+
+def naive(ts):
+    return ts.replace(tzinfo=None).isoformat()
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def write_archive(partitions):
+    """
+    Hand-written manifest plus one Parquet file per month.
+    `partitions` maps "YYYYMM" -> [(symbol, ts, price, qty, is_buyer_maker), ...].
+    """
+    manifest = {"table": archive.TABLE, "partitions": {}}
+    for partition, trades in partitions.items():
+        trades = sorted(trades, key=lambda t: (t[0], t[1]))
+        filename = f"trades_{partition}.parquet"
+        pq.write_table(pa.table({
+            "symbol": pa.array([t[0] for t in trades], pa.string()),
+            "trade_id": pa.array(range(len(trades)), pa.uint64()),
+            "price": pa.array([t[2] for t in trades], pa.float64()),
+            "qty": pa.array([t[3] for t in trades], pa.float64()),
+            "ts": pa.array([t[1] for t in trades], pa.timestamp("ms", tz="UTC")),
+            "is_buyer_maker": pa.array([t[4] for t in trades], pa.uint8()),
+        }), os.path.join(archive.ARCHIVE_DIR, filename))
+        symbols = {}
+        for sym, ts, *_ in trades:
+            s = symbols.setdefault(sym, {"rows": 0, "min_ts": naive(ts), "max_ts": naive(ts)})
+            s["rows"] += 1
+            s["min_ts"], s["max_ts"] = min(s["min_ts"], naive(ts)), max(s["max_ts"], naive(ts))
+        manifest["partitions"][partition] = {"file": filename, "rows": len(trades), "symbols": symbols}
+    archive.save_manifest(manifest)
+
+
+def test_split_starts_cold_range_at_first_archived_month(archive_dir):
+    write_archive({p: [] for p in ("202605", "202606", "202607", "202608", "202609")})
+
+    # window starts inside the archived run
+    start = NOW - timedelta(minutes=100 * DAY)
+    assert archive.split(100 * DAY, NOW) == (int(at(2026, 10, 1).timestamp()), (start, at(2026, 10, 1)))
+
+    # window reaches back past the earliest archived month: archive from May on
+    for days in (200, 400):
+        assert archive.split(days * DAY, NOW) == (int(at(2026, 10, 1).timestamp()), (at(2026, 5, 1), at(2026, 10, 1)))
+
+    # window inside the current (never archived) month
+    assert archive.split(60, NOW) == (0, None)
+
+
+def test_split_month_boundary(archive_dir):
+    write_archive({"202609": []})
+    end = at(2026, 10, 1)
+    # starts on the last minute of the archived month
+    assert archive.split(1, end) == (int(end.timestamp()), (end - timedelta(minutes=1), end))
+    # starts exactly where the archived month ends
+    assert archive.split(1, end + timedelta(minutes=1)) == (0, None)
+    # now inside the archived month (manifest ahead of the clock): cold is capped at now
+    now = at(2026, 9, 30)
+    assert archive.split(60, now) == (int(now.timestamp()), (now - timedelta(minutes=60), now))
+
+
+def test_split_stops_at_manifest_gap(archive_dir):
+    write_archive({p: [] for p in ("202605", "202606", "202608", "202609")})
+
+    assert archive.archived_run(at(2026, 4, 1)) == (at(2026, 5, 1), at(2026, 7, 1))
+    assert archive.split(400 * DAY, NOW) == (int(at(2026, 7, 1).timestamp()), (at(2026, 5, 1), at(2026, 7, 1)))
+
+    # window starting in the missing month goes to ClickHouse as a whole
+    assert archive.archived_run(at(2026, 7, 10)) is None
+    assert archive.split((NOW - at(2026, 7, 10)) // timedelta(minutes=1), NOW) == (0, None)
+
+    # window starting after the gap uses the later run
+    assert archive.archived_run(at(2026, 8, 20)) == (at(2026, 8, 1), at(2026, 10, 1))
+
+
+def test_files_for_prunes_by_manifest_stats(archive_dir):
+    write_archive({
+        "202608": [("BTCUSDT", at(2026, 8, 31, 23, 59, 30), 100.0, 1.0, 0)],
+        "202609": [("BTCUSDT", at(2026, 9, 1, 0, 0, 10), 101.0, 1.0, 0),
+                   ("ETHUSDT", at(2026, 9, 2), 5.0, 1.0, 0)],
+    })
+    name = lambda paths: [os.path.basename(p) for p in paths]
+
+    assert name(archive.files_for("BTCUSDT", at(2026, 8, 31), at(2026, 9, 2))) == [
+        "trades_202608.parquet", "trades_202609.parquet"]
+    assert name(archive.files_for("BTCUSDT", at(2026, 9, 1), at(2026, 9, 2))) == ["trades_202609.parquet"]
+    assert archive.files_for("ETHUSDT", at(2026, 8, 1), at(2026, 9, 1)) == []
+    assert archive.files_for("SOLUSDT", at(2026, 8, 1), at(2026, 10, 1)) == []
+
+
+def test_cold_aggregates_match_clickhouse_columns(archive_dir):
+    write_archive({
+        "202608": [
+            ("BTCUSDT", at(2026, 8, 31, 23, 59, 1), 100.0, 1.0, 0),
+            ("BTCUSDT", at(2026, 8, 31, 23, 59, 30), 104.0, 2.0, 1),
+            ("BTCUSDT", at(2026, 8, 31, 23, 59, 50), 102.0, 1.0, 0),
+            ("ETHUSDT", at(2026, 8, 31, 23, 59, 40), 5.0, 9.0, 0),
+        ],
+        "202609": [
+            ("BTCUSDT", at(2026, 9, 1, 0, 0, 5), 103.0, 3.0, 1),
+            ("BTCUSDT", at(2026, 9, 1, 0, 2, 0), 999.0, 1.0, 0),   # outside the range
+        ],
+    })
+    start, end = at(2026, 8, 31, 23, 59), at(2026, 9, 1, 0, 1)
+
+    ohlcv = archive.cold_ohlcv("BTCUSDT", start, end)
+    assert all(list(r) == OHLCV_COLUMNS for r in ohlcv)
+    assert ohlcv == [
+        {"minute": "2026-08-31T23:59:00", "open": 100.0, "high": 104.0, "low": 100.0, "close": 102.0,
+         "volume": 4.0, "trades": 3},
+        {"minute": "2026-09-01T00:00:00", "open": 103.0, "high": 103.0, "low": 103.0, "close": 103.0,
+         "volume": 3.0, "trades": 1},
+    ]
+
+    buy_sell = archive.cold_buy_sell("BTCUSDT", start, end)
+    assert all(list(r) == BUY_SELL_COLUMNS for r in buy_sell)
+    assert buy_sell == [
+        {"minute": "2026-08-31T23:59:00", "buy_volume": 2.0, "sell_volume": 2.0,
+         "avg_buy_price": 101.0, "avg_sell_price": 104.0, "trades": 3},
+        {"minute": "2026-09-01T00:00:00", "buy_volume": 0.0, "sell_volume": 3.0,
+         "avg_buy_price": None, "avg_sell_price": 103.0, "trades": 1},
+    ]
+
+    assert archive.cold_ohlcv("SOLUSDT", start, end) == []
+
+
+def test_export_refuses_the_current_month_even_with_force(archive_dir, monkeypatch, capsys):
+    def export_partition(client, partition):
+        raise AssertionError(f"exported {partition}")
+
+    monkeypatch.setattr(archive, "ch_client", lambda: None)
+    monkeypatch.setattr(archive, "export_partition", export_partition)
+    current = int(datetime.now(UTC).strftime("%Y%m"))
+
+    archive.export([current], force=True, allow_partial=True)
+    assert "only complete months" in capsys.readouterr().out
+    assert archive.load_manifest()["partitions"] == {}
@@ -0,0 +1,111 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import api.depth as depth
+
+SNAPSHOTS = [
+    {"lastUpdateId": 100, "bids": [["100", "1"]], "asks": [["101", "1"]]},
+    {"lastUpdateId": 111, "bids": [["100", "5"]], "asks": [["101", "5"]]},
+]
+
+EVENTS = [
+    # E, U, u, bids, asks
+    (1000, 99, 101, [["100", "2"]], []),
+    (1100, 102, 102, [], [["101", "3"]]),
+    (1200, 103, 103, [["99", "1"]], []),
+    (1300, 110, 110, [["100", "9"]], []),   # gap (104..109 missing) -> resync
+    (1500, 112, 112, [["100", "6"]], []),
+]
+
+
+def frame(E, U, u, b, a):
+    data = {"e": "depthUpdate", "E": E, "s": "BTCUSDT", "U": U, "u": u, "b": b, "a": a}
+    return json.dumps({"stream": "btcusdt@depth@100ms", "data": data})
+
+
+def ms(dt):
+    return int(dt.timestamp() * 1000)
+
+
+def rows(cols):
+    return [dict(zip(cols, vals)) for vals in zip(*cols.values())]
+
+
+class FakeClickHouse:
+    """Answers book_at()'s queries from the collector's buffered rows."""
+
+    def __init__(self, snapshots, deltas):
+        self.snapshots = rows(snapshots)
+        self.deltas = rows(deltas)
+
+    def query(self, q, parameters=None, settings=None):
+        p = parameters
+        if q is depth.SNAPSHOT_AT_Q:
+            hits = sorted((r for r in self.snapshots if r["symbol"] == p["symbol"] and ms(r["ts"]) <= p["ts_ms"]),
+                          key=lambda r: (r["ts"], r["last_update_id"]), reverse=True)[:1]
+            out = [(ms(r["ts"]), r["last_update_id"], r["bid_prices"], r["bid_qtys"], r["ask_prices"], r["ask_qtys"])
+                   for r in hits]
+        elif q is depth.DELTAS_BETWEEN_Q:
+            hits = sorted((r for r in self.deltas if r["symbol"] == p["symbol"]
+                           and p["from_ms"] <= ms(r["ts"]) <= p["ts_ms"] and r["final_update_id"] > p["from_id"]),
+                          key=lambda r: r["final_update_id"])
+            out = [(r["first_update_id"], r["final_update_id"], r["bid_prices"], r["bid_qtys"],
+                    r["ask_prices"], r["ask_qtys"]) for r in hits]
+        elif q is depth.NEXT_DELTA_Q:
+            hits = sorted((r for r in self.deltas if r["symbol"] == p["symbol"]
+                           and ms(r["ts"]) > p["ts_ms"] and r["final_update_id"] > p["after_id"]),
+                          key=lambda r: (r["ts"], r["final_update_id"]))[:1]
+            out = [(r["first_update_id"],) for r in hits]
+        else:
+            raise AssertionError(f"unexpected query: {q}")
+        return SimpleNamespace(result_rows=out, column_names=(), summary={})
+
+
+def run_collector(monkeypatch):
+    snaps = iter(SNAPSHOTS)
+    monkeypatch.setattr(depth, "fetch_rest_snapshot", lambda symbol, limit=0: next(snaps))
+    dc = depth.DepthCollector()
+    dc._running = True
+
+    async def feed():
+        for ev in EVENTS:
+            dc._decode_batch([frame(*ev)])
+            while dc._sync_tasks:
+                await asyncio.gather(*dc._sync_tasks)
+
+    asyncio.run(feed())
+    return dc
+
+
+def test_collector_syncs_resyncs_and_stamps_snapshots_with_event_time(monkeypatch):
+    dc = run_collector(monkeypatch)
+    assert dc._resyncs == 1
+    assert dc.live_book("BTCUSDT").to_dict()["bids"] == [[100.0, 6.0]]
+    assert [ms(t) for t in dc._snapshots["ts"]] == [1000, 1500]
+    assert dc._snapshots["last_update_id"] == [100, 111]
+    assert dc._deltas["final_update_id"] == [101, 102, 103, 112]
+
+    dc._running = False  # stopped: the frozen book must not be served as live
+    assert dc.live_book("BTCUSDT") is None
+
+
+def test_book_at_replays_deltas_and_flags_gaps(monkeypatch):
+    dc = run_collector(monkeypatch)
+    monkeypatch.setattr(depth, "ch_client", lambda: FakeClickHouse(dc._snapshots, dc._deltas))
+
+    assert depth.book_at("BTCUSDT", 900) is None
+
+    book = depth.book_at("BTCUSDT", 1150)
+    assert book["complete"] and book["deltas_applied"] == 2
+    assert book["bids"] == [[100.0, 2.0]] and book["asks"] == [[101.0, 3.0]]
+
+    # after the last pre-gap delta and before the resync snapshot: not trustworthy
+    for ts in (1250, 1400):
+        book = depth.book_at("BTCUSDT", ts)
+        assert book["complete"] is False
+        assert book["gap"] == {"after_update_id": 103, "next_first_update_id": 112}
+
+    book = depth.book_at("BTCUSDT", 1500)
+    assert book["complete"] and book["last_update_id"] == 112
+    assert book["bids"] == [[100.0, 6.0]]
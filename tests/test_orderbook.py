@@ -0,0 +1,45 @@
+from api.orderbook import OrderBook, decode_levels
+
+
+def make_book():
+    book = OrderBook("BTCUSDT")
+    book.load(
+        10,
+        *decode_levels([["100", "1"], ["99", "2"], ["98", "0"]]),
+        *decode_levels([["102", "3"], ["101", "1"]]),
+    )
+    return book
+
+
+def test_decode_levels():
+    prices, qtys = decode_levels([["1.5", "2"], ["3", "0.25"]])
+    assert list(prices) == [1.5, 3.0]
+    assert list(qtys) == [2.0, 0.25]
+
+
+def test_load_drops_empty_levels_and_orders_best_first():
+    d = make_book().to_dict()
+    assert d["last_update_id"] == 10
+    assert d["bids"] == [[100.0, 1.0], [99.0, 2.0]]
+    assert d["asks"] == [[101.0, 1.0], [102.0, 3.0]]
+
+
+def test_apply_inserts_updates_and_removes():
+    book = make_book()
+    book.apply(
+        11,
+        *decode_levels([["100", "0"], ["99.5", "4"], ["99", "5"]]),
+        *decode_levels([["101", "0"], ["103", "1"], ["104", "0"]]),
+    )
+    d = book.to_dict()
+    assert d["last_update_id"] == 11
+    assert d["bids"] == [[99.5, 4.0], [99.0, 5.0]]
+    assert d["asks"] == [[102.0, 3.0], [103.0, 1.0]]
+
+
+def test_to_dict_limits_levels_and_snapshot_columns():
+    book = make_book()
+    assert book.to_dict(1)["bids"] == [[100.0, 1.0]]
+    bp, bq, ap, aq = book.snapshot_columns()
+    assert list(bp) == [100.0, 99.0] and list(ap) == [101.0, 102.0]
+    assert list(bq) == [1.0, 2.0] and list(aq) == [1.0, 3.0]